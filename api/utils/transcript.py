@@ -1,85 +1,171 @@
+import os
 import re
-from youtube_transcript_api import YouTubeTranscriptApi
-from vector_store import TranscriptVectorStore
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+import numpy as np
+from diskcache import Cache
+from youtube_transcript_api import (
+    NoTranscriptFound,
+    TranscriptsDisabled,
+    VideoUnavailable,
+    YouTubeTranscriptApi,
+)
+from vector_store import MAX_CHUNK_TOKENS, TOKENIZER, TranscriptVectorStore
+
+
+_VIDEO_ID_RE = re.compile(r"(?:v=|\/v\/|youtu\.be\/|\/embed\/)([a-zA-Z0-9_-]{11})")
+_VIDEO_ID_MARKERS = ("/v/", "youtu.be/", "/embed/")
+
+# One client per thread, so each thread reuses its own HTTP session across
+# fetches without sharing it with the store_transcripts_for_rag workers.
+_YTT_LOCAL = threading.local()
+
+# Fetched transcripts are cached on disk by video ID. Known failures (captions
+# disabled, video unavailable, ...) are cached for a shorter time so repeated
+# requests for the same broken video don't keep hitting YouTube.
+_TRANSCRIPT_CACHE = Cache(os.getenv("EMTT_CACHE_DIR", ".cache/transcripts"))
+_TRANSCRIPT_TTL = 7 * 86400
+_FAILURE_TTL = 3600
+
+
+@dataclass(slots=True, frozen=True)
+class TranscriptResult:
+    """Outcome of fetching a YouTube transcript."""
+    success: bool
+    transcript: str | None = None
+    segments: list | None = None
+    video_id: str | None = None
+    error: str | None = None
+
+
+@dataclass(slots=True, frozen=True)
+class StoreResult:
+    """Outcome of storing a YouTube transcript in the vector database."""
+    success: bool
+    video_id: str | None = None
+    segments_stored: int = 0
+    original_segments: int = 0
+    error: str | None = None
+
+
+def _ytt_api() -> YouTubeTranscriptApi:
+    """Return this thread's YouTubeTranscriptApi client, creating it on first use."""
+    api = getattr(_YTT_LOCAL, "api", None)
+    if api is None:
+        api = _YTT_LOCAL.api = YouTubeTranscriptApi()
+    return api
+
+
+@_TRANSCRIPT_CACHE.memoize(expire=_TRANSCRIPT_TTL)
+def _fetch_segments(video_id: str) -> list:
+    """Fetch the raw {text, start, duration} segments for a video ID."""
+    fetched_transcript = _ytt_api().fetch(video_id)
+
+    # Use .to_raw_data() to get list of dicts
+    return fetched_transcript.to_raw_data()
+
+
+def _cache_failure(video_id: str, error: str) -> TranscriptResult:
+    """Remember a failed fetch for a video ID and return its result."""
+    # Only the message is cached so entries don't depend on the result class
+    _TRANSCRIPT_CACHE.set(("failure_message", video_id), error, expire=_FAILURE_TTL)
+    return TranscriptResult(success=False, video_id=video_id, error=error)
 
 
 def extract_video_id(url: str) -> str | None:
     """Extract the video ID from various YouTube URL formats."""
-    patterns = [
-        r"(?:v=|\/v\/|youtu\.be\/|\/embed\/)([a-zA-Z0-9_-]{11})",
-    ]
-    for pattern in patterns:
-        match = re.search(pattern, url)
-        if match:
-            return match.group(1)
-    return None
+    # Fast path for the common watch?v=<id> form, falling back to the regex.
+    # Only taken when this is the earliest place the regex could match, so
+    # both paths agree on URLs like youtu.be/<id>?v=<other>.
+    i = url.find("v=")
+    if i > 0 and url[i - 1] in "?&" and not any(marker in url[:i] for marker in _VIDEO_ID_MARKERS):
+        candidate = url[i + 2:i + 13]
+        if len(candidate) == 11 and candidate.isascii() and candidate.replace("_", "a").replace("-", "a").isalnum():
+            return candidate
+
+    match = _VIDEO_ID_RE.search(url)
+    return match.group(1) if match else None
 
 
-def chunk_segments(segments: list, max_chunk_size: int = 500, overlap_size: int = 50) -> list:
+def chunk_segments(segments: list, window_size: int = 200, stride: int = 150) -> list:
     """
     Combine small transcript segments into larger chunks for better RAG retrieval.
     
+    The transcript is tokenized once with the embedding model's tokenizer and
+    split into sliding windows of `window_size` tokens, advancing `stride`
+    tokens each time, so consecutive chunks overlap by `window_size - stride`.
+    
     Args:
         segments: List of {text, start, duration} dicts from transcript
-        max_chunk_size: Maximum characters per chunk
-        overlap_size: Number of characters to overlap between chunks
+        window_size: Tokens per chunk, at most MAX_CHUNK_TOKENS
+        stride: Tokens between the starts of consecutive chunks
     
     Returns:
         List of chunked segments with combined text and timing metadata
+    
+    Raises:
+        ValueError: If stride is not in (0, window_size] or window_size is
+            longer than the embedding model can take (MAX_CHUNK_TOKENS)
     """
+    if not 0 < stride <= window_size <= MAX_CHUNK_TOKENS:
+        raise ValueError(
+            f"chunking requires 0 < stride <= window_size <= {MAX_CHUNK_TOKENS}, "
+            f"got stride={stride}, window_size={window_size}"
+        )
     if not segments:
         return []
     
-    chunks = []
-    current_chunk_text = ""
-    current_chunk_start = segments[0]["start"]
-    current_chunk_segments = []
-    
-    for segment in segments:
-        segment_text = segment["text"].strip()
-        
-        # Check if adding this segment would exceed max size
-        if len(current_chunk_text) + len(segment_text) + 1 > max_chunk_size and current_chunk_text:
-            # Save current chunk
-            chunks.append({
-                "text": current_chunk_text.strip(),
-                "start": current_chunk_start,
-                "duration": sum(s["duration"] for s in current_chunk_segments),
-                "end": current_chunk_segments[-1]["start"] + current_chunk_segments[-1]["duration"]
-            })
-            
-            # Start new chunk with overlap (include last few segments)
-            overlap_text = ""
-            overlap_segments = []
-            for prev_seg in reversed(current_chunk_segments):
-                if len(overlap_text) + len(prev_seg["text"]) < overlap_size:
-                    overlap_text = prev_seg["text"] + " " + overlap_text
-                    overlap_segments.insert(0, prev_seg)
-                else:
-                    break
-            
-            current_chunk_text = overlap_text
-            current_chunk_start = overlap_segments[0]["start"] if overlap_segments else segment["start"]
-            current_chunk_segments = overlap_segments.copy()
-        
-        # Add segment to current chunk
-        current_chunk_text += " " + segment_text
-        current_chunk_segments.append(segment)
-    
-    # Don't forget the last chunk
-    if current_chunk_text.strip():
-        chunks.append({
-            "text": current_chunk_text.strip(),
-            "start": current_chunk_start,
-            "duration": sum(s["duration"] for s in current_chunk_segments),
-            "end": current_chunk_segments[-1]["start"] + current_chunk_segments[-1]["duration"]
-        })
+    # Pull the segment fields out once into parallel arrays
+    texts = [segment["text"].strip() for segment in segments]
+    starts = np.fromiter((segment["start"] for segment in segments), dtype=np.float64, count=len(segments))
+    durations = np.fromiter((segment["duration"] for segment in segments), dtype=np.float64, count=len(segments))
+    duration_prefix = np.concatenate(([0.0], np.cumsum(durations)))
+    
+    full_text = " ".join(texts)
+    offsets = TOKENIZER(
+        full_text,
+        add_special_tokens=False,
+        return_offsets_mapping=True,
+        verbose=False
+    )["offset_mapping"]
+    n_tokens = len(offsets)
+    if not n_tokens:
+        return []
+    
+    # Map every token to the segment whose text it starts in
+    text_lens = np.fromiter((len(text) for text in texts), dtype=np.int64, count=len(texts))
+    segment_char_starts = np.concatenate(([0], np.cumsum(text_lens[:-1] + 1)))
+    token_char_starts = np.fromiter((char_start for char_start, _ in offsets), dtype=np.int64, count=n_tokens)
+    token_segments = np.searchsorted(segment_char_starts, token_char_starts, side="right") - 1
+    
+    # The window count is known up front: ceil((N - K) / S) + 1
+    n_chunks = max(0, -(-(n_tokens - window_size) // stride)) + 1
+    positions = np.arange(n_chunks) * stride
+    ends = np.minimum(positions + window_size, n_tokens)
+    first = token_segments[positions]
+    last = token_segments[ends - 1]
+    
+    chunks = [
+        {
+            "text": full_text[offsets[pos][0]:offsets[end - 1][1]],
+            "start": start,
+            "duration": duration,
+            "end": chunk_end
+        }
+        for pos, end, start, duration, chunk_end in zip(
+            positions.tolist(),
+            ends.tolist(),
+            starts[first].tolist(),
+            (duration_prefix[last + 1] - duration_prefix[first]).tolist(),
+            (starts[last] + durations[last]).tolist()
+        )
+    ]
     
     return chunks
 
 
-
-def get_youtube_transcript(video_url: str) -> dict:
+def get_youtube_transcript(video_url: str) -> TranscriptResult:
     """
     Fetch the transcript of a YouTube video given its URL.
 
@@ -87,92 +173,77 @@ def get_youtube_transcript(video_url: str) -> dict:
         video_url: Full YouTube video URL.
 
     Returns:
-        A dict with:
-          - "success" (bool)
-          - "transcript" (str | None): Full transcript text if available.
-          - "segments" (list | None): List of {text, start, duration} dicts.
-          - "error" (str | None): Error message if transcript is unavailable.
+        A TranscriptResult with:
+          - success (bool)
+          - transcript (str | None): Full transcript text if available.
+          - segments (list | None): List of {text, start, duration} dicts.
+          - video_id (str | None): Extracted video ID if the URL was valid.
+          - error (str | None): Error message if transcript is unavailable.
     """
     video_id = extract_video_id(video_url)
     if not video_id:
-        return {
-            "success": False,
-            "transcript": None,
-            "segments": None,
-            "error": "Invalid YouTube URL. Could not extract video ID.",
-        }
+        return TranscriptResult(
+            success=False,
+            error="Invalid YouTube URL. Could not extract video ID.",
+        )
+
+    cached_error = _TRANSCRIPT_CACHE.get(("failure_message", video_id))
+    if isinstance(cached_error, str):
+        return TranscriptResult(success=False, video_id=video_id, error=cached_error)
 
     try:
-        ytt_api = YouTubeTranscriptApi()
-        fetched_transcript = ytt_api.fetch(video_id)
+        segments = _fetch_segments(video_id)
 
-        # Use .to_raw_data() to get list of dicts
-        segments = fetched_transcript.to_raw_data()
+        full_text = " ".join([segment["text"] for segment in segments])
 
-        full_text = " ".join(segment["text"] for segment in segments)
-
-        return {
-            "success": True,
-            "transcript": full_text,
-            "segments": segments,
-            "error": None,
-        }
+        return TranscriptResult(
+            success=True,
+            transcript=full_text,
+            segments=segments,
+            video_id=video_id,
+        )
 
+    except TranscriptsDisabled:
+        return _cache_failure(video_id, "Transcripts are disabled for this video.")
+    except NoTranscriptFound:
+        return _cache_failure(video_id, "No transcript found for this video. It may not have captions available.")
+    except VideoUnavailable:
+        return _cache_failure(video_id, "The video is unavailable. It may have been removed or is private.")
     except Exception as e:
-        error_msg = str(e).lower()
-
-        if "disabled" in error_msg:
-            return {
-                "success": False,
-                "transcript": None,
-                "segments": None,
-                "error": "Transcripts are disabled for this video.",
-            }
-        elif "no transcript" in error_msg or "not found" in error_msg:
-            return {
-                "success": False,
-                "transcript": None,
-                "segments": None,
-                "error": "No transcript found for this video. It may not have captions available.",
-            }
-        elif "unavailable" in error_msg:
-            return {
-                "success": False,
-                "transcript": None,
-                "segments": None,
-                "error": "The video is unavailable. It may have been removed or is private.",
-            }
-        else:
-            return {
-                "success": False,
-                "transcript": None,
-                "segments": None,
-                "error": f"An unexpected error occurred: {str(e)}",
-            }
-
-
-def store_transcript_for_rag(video_url: str, vector_store: TranscriptVectorStore = None, chunk_size: int = 500) -> dict:
+        return TranscriptResult(
+            success=False,
+            video_id=video_id,
+            error=f"An unexpected error occurred: {str(e)}",
+        )
+
+
+def _chunk_for_rag(segments: list, chunk_size: int) -> list:
+    """Chunk segments into windows of chunk_size tokens overlapping by a quarter."""
+    return chunk_segments(segments, window_size=chunk_size, stride=max(1, chunk_size * 3 // 4))
+
+
+def store_transcript_for_rag(video_url: str, vector_store: TranscriptVectorStore = None, chunk_size: int = 200) -> StoreResult:
     """
     Fetch and store a YouTube transcript in the vector database for RAG.
     
     Args:
         video_url: Full YouTube video URL
         vector_store: Optional existing vector store instance
-        chunk_size: Maximum characters per chunk (default 500)
+        chunk_size: Tokens per chunk (default 200); chunks overlap by a quarter
     
     Returns:
-        Dict with success status and metadata
+        StoreResult with success status and metadata
     """
     result = get_youtube_transcript(video_url)
     
-    if not result["success"]:
-        return result
+    if not result.success:
+        return StoreResult(success=False, video_id=result.video_id, error=result.error)
     
-    video_id = extract_video_id(video_url)
+    video_id = result.video_id
     store = vector_store or TranscriptVectorStore()
     
     # Chunk the segments into larger pieces
-    chunked_segments = chunk_segments(result["segments"], max_chunk_size=chunk_size)
+    chunked_segments = _chunk_for_rag(result.segments, chunk_size)
     
     success = store.store_transcript(
         video_id=video_id,
@@ -180,13 +251,61 @@ def store_transcript_for_rag(video_url: str, vector_store: TranscriptVectorStore
         video_url=video_url
     )
     
-    return {
-        "success": success,
-        "video_id": video_id,
-        "segments_stored": len(chunked_segments) if success else 0,
-        "original_segments": len(result["segments"]),
-        "error": None if success else "Failed to store in vector database"
-    }
+    return StoreResult(
+        success=success,
+        video_id=video_id,
+        segments_stored=len(chunked_segments) if success else 0,
+        original_segments=len(result.segments),
+        error=None if success else "Failed to store in vector database"
+    )
+
+
+def store_transcripts_for_rag(video_urls: list[str], vector_store: TranscriptVectorStore = None,
+                              chunk_size: int = 200, max_workers: int = 16) -> list[StoreResult]:
+    """
+    Fetch and store several YouTube transcripts in the vector database for RAG.
+    
+    Transcripts are fetched concurrently, then chunked and embedded together
+    in a single pass.
+    
+    Args:
+        video_urls: Full YouTube video URLs
+        vector_store: Optional existing vector store instance
+        chunk_size: Tokens per chunk (default 200); chunks overlap by a quarter
+        max_workers: Maximum number of concurrent transcript fetches
+    
+    Returns:
+        One StoreResult per URL, in the same order as video_urls
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = list(executor.map(get_youtube_transcript, video_urls))
+    
+    # Chunk each fetched video once, even if its URL was passed more than once
+    staged = {}
+    for video_url, result in zip(video_urls, results):
+        if result.success and result.video_id not in staged:
+            staged[result.video_id] = (result.video_id, _chunk_for_rag(result.segments, chunk_size), video_url)
+    
+    stored = {}
+    if staged:
+        store = vector_store or TranscriptVectorStore()
+        stored = store.store_transcripts(list(staged.values()))
+    
+    store_results = []
+    for result in results:
+        if not result.success:
+            store_results.append(StoreResult(success=False, video_id=result.video_id, error=result.error))
+            continue
+        success = stored[result.video_id]
+        store_results.append(StoreResult(
+            success=success,
+            video_id=result.video_id,
+            segments_stored=len(staged[result.video_id][1]) if success else 0,
+            original_segments=len(result.segments),
+            error=None if success else "Failed to store in vector database"
+        ))
+    
+    return store_results
 
 
 # --- Example usage ---
@@ -198,4 +317,4 @@ if __name__ == "__main__":
     matches = store.search("moltbot", n_results=5)
 
     for match in matches:
-        print(f"[{match['metadata']['start']:.1f}s]: {match['text']}")
\ No newline at end of file
+        print(f"[{match.metadata['start']:.1f}s]: {match.text}")
\ No newline at end of file
@@ -1,7 +1,124 @@
 import chromadb
-from chromadb.utils import embedding_functions
-from typing import List, Dict, Any
-import uuid
+import numpy as np
+import os
+import platform
+import torch
+from dataclasses import dataclass
+from functools import lru_cache
+from sentence_transformers import SentenceTransformer
+from typing import List, Dict, Any, Tuple
+
+
+# Stand-in vector for records in the videos collection, which is never searched.
+_VIDEO_PLACEHOLDER_EMBEDDING = [0.0]
+
+# Number of documents embedded and upserted per batch, and the batch size
+# the encoder runs at.
+EMBED_BATCH_SIZE = 64
+
+EMBEDDING_MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+
+
+def _cpu_flags() -> set:
+    """Return the CPU feature flags reported by /proc/cpuinfo, if available."""
+    try:
+        with open("/proc/cpuinfo") as f:
+            for line in f:
+                if line.startswith("flags"):
+                    return set(line.split(":", 1)[1].split())
+    except OSError:
+        pass
+    return set()
+
+
+def _onnx_int8_file_name() -> str:
+    """Pick the int8 ONNX export of the model that matches this CPU."""
+    override = os.getenv("EMTT_ONNX_FILE")
+    if override:
+        return override
+    
+    if platform.machine().lower() in ("arm64", "aarch64"):
+        return "model_qint8_arm64.onnx"
+    
+    flags = _cpu_flags()
+    if "avx512_vnni" in flags:
+        return "model_qint8_avx512_vnni.onnx"
+    if "avx512f" in flags:
+        return "model_qint8_avx512.onnx"
+    return "model_quint8_avx2.onnx"
+
+
+def _load_embedding_model() -> SentenceTransformer:
+    """
+    Load the MiniLM embedding model on the fastest available device.
+    
+    On CUDA or Apple MPS the PyTorch model is run in FP16. On CPU it runs in
+    FP32 unless EMTT_EMBEDDING_INT8 is set, in which case the int8-quantized
+    ONNX export for this CPU is used (override the file with EMTT_ONNX_FILE),
+    which needs the int8 extra installed.
+    """
+    if torch.cuda.is_available():
+        device = "cuda"
+    elif torch.backends.mps.is_available():
+        device = "mps"
+    elif os.getenv("EMTT_EMBEDDING_INT8"):
+        try:
+            import optimum.onnxruntime  # noqa: F401
+        except ImportError as e:
+            raise ImportError(
+                "EMTT_EMBEDDING_INT8 is set but the ONNX runtime packages are missing. "
+                "Install the int8 extra, e.g. `uv sync --extra int8`."
+            ) from e
+        return SentenceTransformer(
+            EMBEDDING_MODEL_NAME,
+            backend="onnx",
+            model_kwargs={"file_name": _onnx_int8_file_name()}
+        )
+    else:
+        return SentenceTransformer(EMBEDDING_MODEL_NAME, device="cpu")
+    
+    model = SentenceTransformer(EMBEDDING_MODEL_NAME, device=device)
+    model.half()
+    return model
+
+
+# Loaded at import so the first store/search call doesn't pay model load latency.
+_MODEL = _load_embedding_model()
+
+# The model's own tokenizer, shared so chunking is measured in the same tokens
+# the embedder sees.
+TOKENIZER = _MODEL.tokenizer
+
+# Content tokens the model embeds per input; the rest of max_seq_length goes
+# to the [CLS] and [SEP] special tokens.
+MAX_CHUNK_TOKENS = _MODEL.max_seq_length - 2
+
+
+@dataclass(slots=True, frozen=True)
+class Match:
+    """A transcript segment returned by a vector search."""
+    text: str
+    metadata: Dict[str, Any]
+    distance: float | None = None
+
+
+def _encode(texts: List[str]) -> List[np.ndarray]:
+    """Embed texts with the shared MiniLM model."""
+    embeddings = _MODEL.encode(
+        texts,
+        batch_size=EMBED_BATCH_SIZE,
+        convert_to_numpy=True,
+        normalize_embeddings=True
+    )
+    return [np.array(embedding, dtype=np.float32) for embedding in embeddings]
+
+
+@lru_cache(maxsize=1024)
+def _embed_query(query: str) -> np.ndarray:
+    """Embed a search query, caching recently seen queries."""
+    embedding = _encode([query])[0]
+    embedding.flags.writeable = False
+    return embedding
 
 
 class TranscriptVectorStore:
@@ -9,12 +126,21 @@ class TranscriptVectorStore:
     
     def __init__(self, collection_name: str = "youtube_transcripts", persist_directory: str = "./chroma_db"):
         self.client = chromadb.PersistentClient(path=persist_directory)
-        self.embedding_function = embedding_functions.SentenceTransformerEmbeddingFunction(
-            model_name="all-MiniLM-L6-v2"
-        )
+        # Every write and query passes precomputed vectors from _encode, so the
+        # collection is opened without an embedding function. This also keeps
+        # collections created with Chroma's sentence_transformer function
+        # openable, since there is no function config to conflict with.
         self.collection = self.client.get_or_create_collection(
             name=collection_name,
-            embedding_function=self.embedding_function
+            embedding_function=None
+        )
+        # Per-video data such as the URL is stored once here, keyed by video ID,
+        # instead of being repeated in every segment's metadata. It is only ever
+        # looked up by ID, so records get a placeholder vector and no embedding
+        # function runs over them.
+        self.videos_collection = self.client.get_or_create_collection(
+            name=f"{collection_name}_videos",
+            embedding_function=None
         )
     
     def store_transcript(self, video_id: str, segments: List[Dict[str, Any]], video_url: str = None) -> bool:
@@ -29,33 +155,96 @@ class TranscriptVectorStore:
         Returns:
             True if successful, False otherwise
         """
-        try:
-            documents = []
-            metadatas = []
-            ids = []
-            
+        return self.store_transcripts([(video_id, segments, video_url)])[video_id]
+    
+    def store_transcripts(self, transcripts: List[Tuple[str, List[Dict[str, Any]], str | None]]) -> Dict[str, bool]:
+        """
+        Store the segments of several videos in one embedding pass.
+        
+        Args:
+            transcripts: List of (video_id, segments, video_url) tuples
+        
+        Returns:
+            Dict mapping each video ID to True if it was stored, False otherwise
+        """
+        n = sum(len(segments) for _, segments, _ in transcripts)
+        documents = [None] * n
+        metadatas = [None] * n
+        ids = [None] * n
+        
+        # Auto-captions often repeat the same text, so only unique documents
+        # are embedded and their vectors are fanned back out by index.
+        seen = {}
+        unique_docs = []
+        unique_idx_of = [None] * n
+        
+        # (video_id, video_url, begin, end) row range of each video
+        spans = []
+        j = 0
+        for video_id, segments, video_url in transcripts:
+            begin = j
             for i, segment in enumerate(segments):
-                documents.append(segment["text"])
-                metadatas.append({
+                documents[j] = segment["text"]
+                metadatas[j] = {
                     "video_id": video_id,
-                    "video_url": video_url or "",
                     "start": segment["start"],
                     "duration": segment["duration"],
                     "segment_index": i
-                })
-                ids.append(f"{video_id}_{i}_{uuid.uuid4().hex[:8]}")
-            
-            self.collection.add(
-                documents=documents,
-                metadatas=metadatas,
-                ids=ids
-            )
-            return True
+                }
+                # Deterministic IDs, unique per video and segment
+                ids[j] = f"{video_id}_{i}"
+                
+                idx = seen.setdefault(segment["text"], len(unique_docs))
+                if idx == len(unique_docs):
+                    unique_docs.append(segment["text"])
+                unique_idx_of[j] = idx
+                j += 1
+            spans.append((video_id, video_url, begin, j))
+        
+        try:
+            # Embed in fixed-size batches to bound embedding memory on long videos
+            unique_embeddings = []
+            for start in range(0, len(unique_docs), EMBED_BATCH_SIZE):
+                unique_embeddings.extend(_encode(unique_docs[start:start + EMBED_BATCH_SIZE]))
+            embeddings = [unique_embeddings[idx] for idx in unique_idx_of]
         except Exception as e:
             print(f"Error storing transcript: {e}")
-            return False
+            return {video_id: False for video_id, _, _ in transcripts}
+        
+        stored = {}
+        for video_id, video_url, begin, end in spans:
+            try:
+                for start in range(begin, end, EMBED_BATCH_SIZE):
+                    stop = min(start + EMBED_BATCH_SIZE, end)
+                    self.collection.upsert(
+                        embeddings=embeddings[start:stop],
+                        documents=documents[start:stop],
+                        metadatas=metadatas[start:stop],
+                        ids=ids[start:stop]
+                    )
+                
+                if video_url:
+                    self.videos_collection.upsert(
+                        embeddings=[_VIDEO_PLACEHOLDER_EMBEDDING],
+                        documents=[video_url],
+                        metadatas=[{"video_url": video_url}],
+                        ids=[video_id]
+                    )
+                
+                # Only once the new rows are in, drop rows this ingest didn't
+                # write: leftovers from a longer earlier version or rows stored
+                # under older ID schemes. A failed re-ingest keeps the old copy.
+                stale = set(self.collection.get(where={"video_id": video_id}, include=[])["ids"]) - set(ids[begin:end])
+                if stale:
+                    self.collection.delete(ids=list(stale))
+                stored[video_id] = True
+            except Exception as e:
+                print(f"Error storing transcript for {video_id}: {e}")
+                stored[video_id] = False
+        
+        return stored
     
-    def search(self, query: str, n_results: int = 5, video_id: str = None) -> List[Dict[str, Any]]:
+    def search(self, query: str, n_results: int = 5, video_id: str = None) -> List[Match]:
         """
         Search for relevant transcript segments.
         
@@ -70,25 +259,39 @@ class TranscriptVectorStore:
         where_filter = {"video_id": video_id} if video_id else None
         
         results = self.collection.query(
-            query_texts=[query],
+            query_embeddings=[_embed_query(query)],
             n_results=n_results,
             where=where_filter
         )
         
         matches = []
         for i in range(len(results["documents"][0])):
-            matches.append({
-                "text": results["documents"][0][i],
-                "metadata": results["metadatas"][0][i],
-                "distance": results["distances"][0][i] if results["distances"] else None
-            })
+            matches.append(Match(
+                text=results["documents"][0][i],
+                metadata=results["metadatas"][0][i],
+                distance=results["distances"][0][i] if results["distances"] else None
+            ))
         
         return matches
     
+    def get_video_url(self, video_id: str) -> str | None:
+        """Look up the URL a video was stored with, if any."""
+        result = self.videos_collection.get(ids=[video_id])
+        if result["ids"]:
+            return result["metadatas"][0]["video_url"]
+        
+        # Segments stored before URLs moved to the videos collection still carry
+        # video_url in their own metadata until the video is re-ingested.
+        result = self.collection.get(where={"video_id": video_id}, limit=1, include=["metadatas"])
+        if result["ids"]:
+            return result["metadatas"][0].get("video_url") or None
+        return None
+    
     def delete_video(self, video_id: str) -> bool:
         """Delete all segments for a specific video."""
         try:
             self.collection.delete(where={"video_id": video_id})
+            self.videos_collection.delete(ids=[video_id])
             return True
         except Exception as e:
             print(f"Error deleting video: {e}")